@@ -0,0 +1,42 @@
+# Production launcher: gunicorn -c gunicorn.conf.py server:app
+#
+# Each worker is a full uvicorn event loop, so one worker per core is enough.
+# Slot locks and rate-limit buckets only agree across workers through Redis, so
+# without REDIS_URL a single worker is started and asking for more is an error.
+#
+# Rate limiting keys anonymous clients by IP. RATE_LIMIT_TRUSTED_HOPS (default 1)
+# is the number of proxies in front of the app that append to X-Forwarded-For;
+# the client IP is the entry the outermost of them added, counted from the
+# right. Set it to 0 when clients connect to gunicorn directly, otherwise they
+# can pick their own IP.
+
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8001")
+if os.environ.get("REDIS_URL"):
+    # CPUs this process may actually run on (respects container cpusets), capped so a
+    # large host doesn't start a Motor connection pool per core
+    workers = int(os.environ.get("WEB_CONCURRENCY", min(len(os.sched_getaffinity(0)), 8)))
+else:
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    if workers > 1:
+        raise RuntimeError(
+            "WEB_CONCURRENCY > 1 requires REDIS_URL; in-process locks and rate limits "
+            "are not shared between workers"
+        )
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Load the app in each worker so Motor/Redis clients are created on that worker's event loop
+preload_app = False
+
+keepalive = int(os.environ.get("KEEPALIVE", "5"))
+timeout = int(os.environ.get("WORKER_TIMEOUT", "60"))
+graceful_timeout = 30
+
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.environ.get("MAX_REQUESTS", "10000"))
+max_requests_jitter = 1000
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "info")
@@ -0,0 +1,263 @@
+import asyncio
+import cProfile
+import contextvars
+import hmac
+import json
+import logging
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+logger = logging.getLogger(__name__)
+
+# ========= PROFILING =========
+#
+# Opt-in per-request profiling. Nothing here is installed unless the server
+# enables it, so a disabled deployment pays no cost. For a sampled request, or
+# one whose X-Profile header carries the configured token, we record a CPU
+# profile plus every Motor query it issued, then write both (with explain()
+# plans) to the output directory.
+
+# Queries issued by the request being profiled; None for every other request
+captured_queries: contextvars.ContextVar[Optional[List[dict]]] = contextvars.ContextVar(
+    "captured_queries", default=None
+)
+
+# Operations whose first argument is a filter we can explain
+FILTER_OPERATIONS = {
+    "find", "find_one", "count_documents", "find_one_and_update",
+    "update_one", "update_many", "delete_one", "delete_many",
+}
+
+def sort_spec(key_or_list, direction=None) -> dict:
+    """Normalise Motor's sort() arguments into a command sort document"""
+    if isinstance(key_or_list, str):
+        return {key_or_list: direction if direction is not None else 1}
+    return dict(key_or_list)
+
+class ProfiledCursor:
+    """Motor cursor proxy that adds chained sort/limit/skip and to_list length to the recorded query"""
+
+    def __init__(self, cursor, query: dict):
+        self._cursor = cursor
+        self._query = query
+
+    def sort(self, key_or_list, direction=None):
+        self._query.setdefault("sort", {}).update(sort_spec(key_or_list, direction))
+        self._cursor.sort(key_or_list, direction)
+        return self
+
+    def limit(self, limit: int):
+        self._query["limit"] = limit
+        self._cursor.limit(limit)
+        return self
+
+    def skip(self, skip: int):
+        self._query["skip"] = skip
+        self._cursor.skip(skip)
+        return self
+
+    def to_list(self, length: Optional[int]):
+        # to_list(n) stops after n documents, so explain it as a limit
+        if length is not None:
+            self._query["limit"] = min(self._query.get("limit") or length, length)
+        return self._cursor.to_list(length)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class ProfiledCollection:
+    """Motor collection proxy that records queries while a profile is active"""
+
+    def __init__(self, collection: AsyncIOMotorCollection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        queries = captured_queries.get()
+        if queries is None or (name not in FILTER_OPERATIONS and name != "aggregate"):
+            return attr
+
+        def recorded(*args, **kwargs):
+            default = [] if name == "aggregate" else {}
+            query = {
+                "collection": self._collection.name,
+                "operation": name,
+                "query": args[0] if args else kwargs.get("filter", kwargs.get("pipeline", default)),
+            }
+            if name in ("find", "find_one"):
+                projection = args[1] if len(args) > 1 else kwargs.get("projection")
+                if projection is not None:
+                    query["projection"] = projection
+                if name == "find_one":
+                    query["limit"] = 1
+            if "sort" in kwargs and kwargs["sort"]:
+                query["sort"] = sort_spec(kwargs["sort"])
+            queries.append(query)
+
+            result = attr(*args, **kwargs)
+            if name == "find":
+                return ProfiledCursor(result, query)
+            return result
+        return recorded
+
+class ProfiledDatabase:
+    """Motor database proxy handing out ProfiledCollection objects"""
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name):
+        attr = getattr(self._database, name)
+        if isinstance(attr, AsyncIOMotorCollection):
+            return ProfiledCollection(attr)
+        return attr
+
+    def __getitem__(self, name):
+        return ProfiledCollection(self._database[name])
+
+class CPUProfile:
+    """pyinstrument when installed (async-aware), otherwise cProfile if allowed"""
+
+    # cProfile hooks the whole thread, so only one can run at a time
+    _cprofile_active = False
+
+    def __init__(self, allow_cprofile: bool = True):
+        self.profiler = None
+        self.kind = None
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            if allow_cprofile and not CPUProfile._cprofile_active:
+                CPUProfile._cprofile_active = True
+                self.profiler = cProfile.Profile()
+                self.kind = "cprofile"
+        else:
+            self.profiler = Profiler(async_mode="enabled")
+            self.kind = "pyinstrument"
+
+    def start(self):
+        if self.kind == "cprofile":
+            self.profiler.enable()
+        elif self.kind == "pyinstrument":
+            self.profiler.start()
+
+    def stop(self):
+        if self.kind == "cprofile":
+            self.profiler.disable()
+            CPUProfile._cprofile_active = False
+        elif self.kind == "pyinstrument":
+            self.profiler.stop()
+
+    def save(self, directory: Path):
+        """Blocking; run it off the event loop"""
+        if self.kind == "cprofile":
+            self.profiler.dump_stats(directory / "profile.prof")
+        elif self.kind == "pyinstrument":
+            (directory / "profile.html").write_text(self.profiler.output_html())
+
+async def explain_query(database, query: dict) -> dict:
+    """Run explain() in executionStats mode for a recorded query"""
+    collection = query["collection"]
+    if query["operation"] == "aggregate":
+        command = {"aggregate": collection, "pipeline": query["query"], "cursor": {}}
+    elif query["operation"] == "count_documents":
+        command = {"count": collection, "query": query["query"]}
+    else:
+        command = {"find": collection, "filter": query["query"]}
+        for option in ("projection", "sort", "skip", "limit"):
+            if option in query:
+                command[option] = query[option]
+
+    return await database.command({"explain": command, "verbosity": "executionStats"})
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling sampled or X-Profile-flagged requests"""
+
+    def __init__(self, app, database, output_dir: str, sample_rate: float = 0.0, token: Optional[str] = None):
+        self.app = app
+        self.database = database
+        self.output_dir = Path(output_dir)
+        self.sample_rate = sample_rate
+        # X-Profile is only honoured when it carries this token; without one, only sampling applies
+        self.token = token.encode() if token else None
+
+    def _profile_reason(self, scope) -> Optional[str]:
+        """'flagged' for a valid X-Profile header, 'sampled' for a sampled request, else None"""
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == b"x-profile" and hmac.compare_digest(value, self.token):
+                    return "flagged"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        reason = self._profile_reason(scope) if scope["type"] == "http" else None
+        if not reason:
+            await self.app(scope, receive, send)
+            return
+
+        response_status = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response_status["code"] = message["status"]
+            await send(message)
+
+        queries: List[dict] = []
+        token = captured_queries.set(queries)
+        # cProfile sees every request on the event loop thread; only use it when someone asked
+        profile = CPUProfile(allow_cprofile=reason == "flagged")
+        started = time.perf_counter()
+        profile.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.stop()
+            duration_ms = (time.perf_counter() - started) * 1000
+            captured_queries.reset(token)
+            # The response has already been sent; explain() runs off the request's clock
+            try:
+                await self._save(scope, reason, response_status.get("code"), duration_ms, profile, queries)
+            except Exception as e:
+                logger.error(f"Failed to save profile: {e}")
+
+    async def _save(self, scope, reason: str, status_code, duration_ms: float, profile: CPUProfile, queries: List[dict]):
+        timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        route = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_")
+        directory = self.output_dir / f"{timestamp}_{scope['method']}_{route}_{uuid.uuid4().hex[:6]}"
+        await asyncio.to_thread(directory.mkdir, parents=True, exist_ok=True)
+
+        await asyncio.to_thread(profile.save, directory)
+
+        for query in queries:
+            try:
+                query["explain"] = await explain_query(self.database, query)
+            except Exception as e:
+                query["explain_error"] = str(e)
+
+        summary = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "query_string": scope.get("query_string", b"").decode("latin-1"),
+            "reason": reason,
+            "status_code": status_code,
+            "duration_ms": round(duration_ms, 2),
+            "cpu_profiler": profile.kind,
+            "cpu_profile_scope": (
+                "event loop thread, includes other concurrent requests"
+                if profile.kind == "cprofile" else "this request"
+            ),
+            "queries": queries,
+        }
+        await asyncio.to_thread(
+            (directory / "request.json").write_text, json.dumps(summary, indent=2, default=str)
+        )
+        logger.info(f"Saved profile for {scope['method']} {scope['path']} to {directory}")
@@ -1,17 +1,27 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Cookie, Response, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Cookie, Request, Response, Depends, status
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.routing import Match
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import Dict, List, NamedTuple, Optional
 import uuid
+import time
+import hashlib
 from datetime import datetime, timezone, timedelta
 import httpx
 
+from profiling import ProfiledDatabase, ProfilingMiddleware
+from shared_state import RedisState, SharedState, create_shared_state
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -20,6 +30,14 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Opt-in request profiling; when off, neither the db proxy nor the middleware is installed
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+if PROFILING_ENABLED:
+    db = ProfiledDatabase(db)
+
+# Cross-worker state (cache, counters, locks, pub/sub); in-process unless REDIS_URL is set
+shared_state: SharedState = create_shared_state(os.environ.get('REDIS_URL'))
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -42,6 +60,7 @@ class User(BaseModel):
     picture: Optional[str] = None
     wallet_balance: float = Field(default=0.0)
     is_admin: bool = Field(default=False)
+    data_version: int = Field(default=0)  # bumped on every write to the user's wallet/bookings
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class UserSession(BaseModel):
@@ -59,7 +78,7 @@ class WalletTransaction(BaseModel):
     amount: float
     bonus: float = 0.0
     final_amount: float
-    transaction_type: str  # 'topup' or 'booking'
+    transaction_type: str  # 'topup', 'booking' or 'refund'
     booking_id: Optional[str] = None
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -87,6 +106,23 @@ class Booking(BaseModel):
     total_price: float
     payment_method: str
     payment_status: str = "completed"
+    status: str = "confirmed"  # 'confirmed' or 'cancelled'
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class WaitlistEntry(BaseModel):
+    id: str = Field(default_factory=lambda: f"wait_{uuid.uuid4().hex[:12]}")
+    user_id: str
+    user_name: str
+    user_email: str
+    date: str
+    start_time: str
+    end_time: str
+    duration_minutes: int
+    ps5_setup: int
+    controllers: int
+    payment_method: str
+    status: str = "waiting"  # 'waiting', 'allocating', 'allocated', 'unfunded', 'expired' or 'cancelled'
+    booking_id: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # ========= AUTH HELPERS =========
@@ -142,6 +178,59 @@ async def get_current_user_from_header(authorization: str = None):
     """Dependency to extract user from Authorization header"""
     return await get_current_user(authorization=authorization)
 
+# ========= HTTP CACHING HELPERS =========
+
+async def bump_user_version(user_id: str):
+    """Invalidate cached reads for a user; call after the write has been persisted"""
+    await db.users.update_one({"id": user_id}, {"$inc": {"data_version": 1}})
+
+# Part of every ETag so a deploy that changes response shapes invalidates cached bodies
+APP_VERSION = os.environ.get('APP_VERSION') or hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:8]
+
+def not_modified(request: Request, response: Response, user: User, resource: str) -> Optional[Response]:
+    """Return a 304 response if the client's ETag is current, else set the ETag on response"""
+    # Weak, since the same tag covers the gzip, brotli and identity encodings of the body
+    opaque_tag = f'"{APP_VERSION}-{resource}-{user.id}-{user.data_version}"'
+    headers = {"ETag": f"W/{opaque_tag}", "Cache-Control": "private, no-cache"}
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # If-None-Match uses weak comparison: only the opaque tags have to match
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if opaque_tag in candidates or "*" in candidates:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    response.headers.update(headers)
+    return None
+
+# ========= ARCHIVE HELPERS =========
+
+# Bookings/transactions older than this move to "<collection>_archive"
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '90'))
+
+def archive_cutoff() -> datetime:
+    """Oldest moment still kept in the hot collections"""
+    return datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+async def find_with_history(
+    collection: str,
+    query: dict,
+    sort_field: str,
+    sort_direction: int,
+    limit: int,
+    include_history: bool
+) -> List[dict]:
+    """Query the hot collection, merging in the archive only when history is requested"""
+    if not include_history:
+        return await db[collection].find(query).sort(sort_field, sort_direction).to_list(limit)
+    
+    hot, archived = await asyncio.gather(
+        db[collection].find(query).sort(sort_field, sort_direction).to_list(limit),
+        db[f"{collection}_archive"].find(query).sort(sort_field, sort_direction).to_list(limit),
+    )
+    merged = sorted(hot + archived, key=lambda doc: doc[sort_field], reverse=sort_direction == -1)
+    return merged[:limit]
+
 # ========= AUTH ROUTES =========
 
 @api_router.post("/auth/session")
@@ -210,8 +299,12 @@ async def create_session(session_id: str, response: Response):
         )
 
 @api_router.get("/auth/me")
-async def get_me(user: User = Depends(get_current_user)):
+async def get_me(request: Request, response: Response, user: User = Depends(get_current_user)):
     """Get current user info"""
+    cached = not_modified(request, response, user, "me")
+    if cached:
+        return cached
+    
     return user
 
 @api_router.post("/auth/logout")
@@ -259,6 +352,7 @@ async def topup_wallet(
         transaction_type="topup"
     )
     await db.wallet_transactions.insert_one(transaction.dict())
+    await bump_user_version(user.id)
     
     # Get updated balance
     updated_user = await db.users.find_one({"id": user.id})
@@ -272,17 +366,30 @@ async def topup_wallet(
     }
 
 @api_router.get("/wallet/balance")
-async def get_wallet_balance(user: User = Depends(get_current_user)):
+async def get_wallet_balance(request: Request, response: Response, user: User = Depends(get_current_user)):
     """Get wallet balance"""
+    cached = not_modified(request, response, user, "balance")
+    if cached:
+        return cached
+    
     updated_user = await db.users.find_one({"id": user.id})
     return {"balance": updated_user["wallet_balance"]}
 
 @api_router.get("/wallet/transactions")
-async def get_wallet_transactions(user: User = Depends(get_current_user)):
+async def get_wallet_transactions(
+    request: Request,
+    response: Response,
+    include_history: bool = False,
+    user: User = Depends(get_current_user)
+):
     """Get wallet transaction history"""
-    transactions = await db.wallet_transactions.find(
-        {"user_id": user.id}
-    ).sort("timestamp", -1).to_list(100)
+    cached = not_modified(request, response, user, "transactions-history" if include_history else "transactions")
+    if cached:
+        return cached
+    
+    transactions = await find_with_history(
+        "wallet_transactions", {"user_id": user.id}, "timestamp", -1, 100, include_history
+    )
     
     return [WalletTransaction(**txn) for txn in transactions]
 
@@ -316,14 +423,8 @@ def calculate_end_time(start_time: str, duration_minutes: int):
     end_dt = start_dt + timedelta(minutes=duration_minutes)
     return end_dt.strftime('%H:%M')
 
-@api_router.post("/bookings")
-async def create_booking(
-    booking_data: BookingCreate,
-    user: User = Depends(get_current_user)
-):
-    """Create a new booking"""
-    
-    # Validate inputs
+def validate_booking_request(booking_data: BookingCreate):
+    """Reject out-of-range booking options"""
     if booking_data.ps5_setup not in [1, 2]:
         raise HTTPException(status_code=400, detail="Invalid PS5 setup. Must be 1 or 2")
     
@@ -332,103 +433,197 @@ async def create_booking(
     
     if booking_data.duration_minutes not in [30, 60, 120, 180]:
         raise HTTPException(status_code=400, detail="Invalid duration")
+
+def slot_is_free(start_time: str, end_time: str, occupied_slots: List[dict]):
+    """Check a time range against booked ranges"""
+    return all(
+        start_time >= slot["end_time"] or end_time <= slot["start_time"]
+        for slot in occupied_slots
+    )
+
+def slot_lock(date: str, ps5_setup: int):
+    """Lock serialising every booking write for a date/setup, across workers"""
+    return shared_state.lock(f"slots:{date}:{ps5_setup}", timeout=30)
+
+async def debit_wallet(user_id: str, amount: float) -> bool:
+    """Atomically deduct amount from the wallet if the balance covers it"""
+    result = await db.users.update_one(
+        {"id": user_id, "wallet_balance": {"$gte": amount}},
+        {"$inc": {"wallet_balance": -amount}}
+    )
+    return result.modified_count == 1
+
+async def save_booking(booking: Booking):
+    """Persist a paid booking and its wallet transaction"""
+    await db.bookings.insert_one(booking.dict())
     
-    # Check for conflicting bookings
-    end_time = calculate_end_time(booking_data.start_time, booking_data.duration_minutes)
+    # Record wallet transaction if paid via wallet
+    if booking.payment_method == "wallet":
+        transaction = WalletTransaction(
+            user_id=booking.user_id,
+            amount=-booking.total_price,
+            bonus=0.0,
+            final_amount=-booking.total_price,
+            transaction_type="booking",
+            booking_id=booking.id
+        )
+        await db.wallet_transactions.insert_one(transaction.dict())
     
-    existing_bookings = await db.bookings.find({
-        "date": booking_data.date,
-        "ps5_setup": booking_data.ps5_setup
-    }).to_list(100)
+    await bump_user_version(booking.user_id)
+
+@api_router.post("/bookings")
+async def create_booking(
+    booking_data: BookingCreate,
+    user: User = Depends(get_current_user)
+):
+    """Create a new booking"""
+    validate_booking_request(booking_data)
     
-    # Check time overlap
-    for existing in existing_bookings:
-        if not (booking_data.start_time >= existing["end_time"] or end_time <= existing["start_time"]):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Time slot already booked for PS5 Setup {booking_data.ps5_setup}"
-            )
+    end_time = calculate_end_time(booking_data.start_time, booking_data.duration_minutes)
     
     # Calculate price
     pricing = calculate_price(booking_data.duration_minutes, booking_data.controllers)
     total_price = pricing["total_price"]
     
-    # Handle payment
-    if booking_data.payment_method == "wallet":
-        updated_user = await db.users.find_one({"id": user.id})
-        if updated_user["wallet_balance"] < total_price:
+    async with slot_lock(booking_data.date, booking_data.ps5_setup):
+        # Freed capacity goes to queued customers who can pay before any direct booking
+        await allocate_waitlist(booking_data.date, booking_data.ps5_setup)
+        
+        # Check for conflicting bookings
+        occupied_slots = await get_occupied_slots(booking_data.date, booking_data.ps5_setup)
+        
+        if not slot_is_free(booking_data.start_time, end_time, occupied_slots):
             raise HTTPException(
                 status_code=400,
-                detail="Insufficient wallet balance"
+                detail=f"Time slot already booked for PS5 Setup {booking_data.ps5_setup}"
             )
         
-        # Deduct from wallet
-        await db.users.update_one(
-            {"id": user.id},
-            {"$inc": {"wallet_balance": -total_price}}
+        # Handle payment
+        if booking_data.payment_method == "wallet":
+            if not await debit_wallet(user.id, total_price):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Insufficient wallet balance"
+                )
+        
+        # Create booking
+        booking = Booking(
+            user_id=user.id,
+            user_name=user.name,
+            user_email=user.email,
+            date=booking_data.date,
+            start_time=booking_data.start_time,
+            end_time=end_time,
+            duration_minutes=booking_data.duration_minutes,
+            ps5_setup=booking_data.ps5_setup,
+            controllers=booking_data.controllers,
+            base_price=pricing["base_price"],
+            controller_charges=pricing["controller_charges"],
+            total_price=total_price,
+            payment_method=booking_data.payment_method,
+            payment_status="completed"
         )
+        
+        await save_booking(booking)
     
-    # Create booking
-    booking = Booking(
-        user_id=user.id,
-        user_name=user.name,
-        user_email=user.email,
-        date=booking_data.date,
-        start_time=booking_data.start_time,
-        end_time=end_time,
-        duration_minutes=booking_data.duration_minutes,
-        ps5_setup=booking_data.ps5_setup,
-        controllers=booking_data.controllers,
-        base_price=pricing["base_price"],
-        controller_charges=pricing["controller_charges"],
-        total_price=total_price,
-        payment_method=booking_data.payment_method,
-        payment_status="completed"
-    )
+    return booking
+
+@api_router.post("/bookings/{booking_id}/cancel")
+async def cancel_booking(booking_id: str, user: User = Depends(get_current_user)):
+    """Cancel a booking, refund wallet payments and hand the slot to the waitlist"""
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    cancellable = {
+        "id": booking_id,
+        "user_id": user.id,
+        "date": {"$gte": today},
+        "status": {"$ne": "cancelled"}
+    }
     
-    await db.bookings.insert_one(booking.dict())
+    booking = await db.bookings.find_one(cancellable, {"_id": 0, "date": 1, "ps5_setup": 1})
+    if not booking:
+        raise HTTPException(status_code=404, detail="Booking not found or cannot be cancelled")
     
-    # Record wallet transaction if paid via wallet
-    if booking_data.payment_method == "wallet":
-        transaction = WalletTransaction(
-            user_id=user.id,
-            amount=-total_price,
-            bonus=0.0,
-            final_amount=-total_price,
-            transaction_type="booking",
-            booking_id=booking.id
+    # Hold the slot lock until the waitlist has been served, so direct bookings can't jump the queue
+    async with slot_lock(booking["date"], booking["ps5_setup"]):
+        # Flipping the status is the single atomic step, so a refund can only happen once
+        booking = await db.bookings.find_one_and_update(cancellable, {"$set": {"status": "cancelled"}})
+        if not booking:
+            raise HTTPException(status_code=404, detail="Booking not found or cannot be cancelled")
+        
+        # Release the waitlist entry this booking came from, so the slot can't loop back to it
+        await db.waitlist.update_one(
+            {"booking_id": booking_id, "status": "allocated"},
+            {"$set": {"status": "cancelled"}}
         )
-        await db.wallet_transactions.insert_one(transaction.dict())
+        
+        refunded = 0.0
+        if booking["payment_method"] == "wallet":
+            refunded = booking["total_price"]
+            await db.users.update_one(
+                {"id": user.id},
+                {"$inc": {"wallet_balance": refunded}}
+            )
+            transaction = WalletTransaction(
+                user_id=user.id,
+                amount=refunded,
+                bonus=0.0,
+                final_amount=refunded,
+                transaction_type="refund",
+                booking_id=booking_id
+            )
+            await db.wallet_transactions.insert_one(transaction.dict())
+        
+        await bump_user_version(user.id)
+        
+        allocated = await allocate_waitlist(booking["date"], booking["ps5_setup"])
     
-    return booking
+    return {
+        "booking_id": booking_id,
+        "status": "cancelled",
+        "refunded": refunded,
+        "reallocated_to_waitlist": len(allocated)
+    }
 
 @api_router.get("/bookings/my-bookings")
-async def get_my_bookings(user: User = Depends(get_current_user)):
+async def get_my_bookings(
+    request: Request,
+    response: Response,
+    include_history: bool = False,
+    user: User = Depends(get_current_user)
+):
     """Get current user's bookings"""
-    bookings = await db.bookings.find(
-        {"user_id": user.id}
-    ).sort("created_at", -1).to_list(100)
+    cached = not_modified(request, response, user, "my-bookings-history" if include_history else "my-bookings")
+    if cached:
+        return cached
+    
+    bookings = await find_with_history(
+        "bookings", {"user_id": user.id}, "created_at", -1, 100, include_history
+    )
     
     return [Booking(**booking) for booking in bookings]
 
-@api_router.get("/bookings/availability")
-async def check_availability(date: str, ps5_setup: int):
-    """Check availability for a specific date and setup"""
-    if ps5_setup not in [1, 2]:
-        raise HTTPException(status_code=400, detail="Invalid PS5 setup")
-    
-    bookings = await db.bookings.find({
-        "date": date,
-        "ps5_setup": ps5_setup
-    }).to_list(100)
+async def get_occupied_slots(date: str, ps5_setup: int):
+    """Get booked time ranges for a date and setup"""
+    bookings = await db.bookings.find(
+        {"date": date, "ps5_setup": ps5_setup, "status": {"$ne": "cancelled"}},
+        {"_id": 0, "start_time": 1, "end_time": 1}
+    ).to_list(100)
     
-    occupied_slots = [
+    return [
         {
             "start_time": booking["start_time"],
             "end_time": booking["end_time"]
         }
         for booking in bookings
     ]
+
+@api_router.get("/bookings/availability")
+async def check_availability(date: str, ps5_setup: int):
+    """Check availability for a specific date and setup"""
+    if ps5_setup not in [1, 2]:
+        raise HTTPException(status_code=400, detail="Invalid PS5 setup")
+    
+    occupied_slots = await get_occupied_slots(date, ps5_setup)
     
     return {
         "date": date,
@@ -447,11 +642,219 @@ async def calculate_booking_price(duration_minutes: int, controllers: int):
     
     return calculate_price(duration_minutes, controllers)
 
+# ========= WAITLIST ROUTES =========
+
+async def book_waitlist_entry(entry: WaitlistEntry) -> Optional[Booking]:
+    """Turn a waitlist entry into a paid booking; None if it was withdrawn or can't be paid"""
+    claimed = await db.waitlist.find_one_and_update(
+        {"id": entry.id, "status": "waiting"},
+        {"$set": {"status": "allocating"}}
+    )
+    if not claimed:
+        return None
+    
+    pricing = calculate_price(entry.duration_minutes, entry.controllers)
+    if entry.payment_method == "wallet" and not await debit_wallet(entry.user_id, pricing["total_price"]):
+        # Can't pay for the slot they queued for; drop them so they don't hold it for others
+        await db.waitlist.update_one({"id": entry.id}, {"$set": {"status": "unfunded"}})
+        return None
+    
+    booking = Booking(
+        user_id=entry.user_id,
+        user_name=entry.user_name,
+        user_email=entry.user_email,
+        date=entry.date,
+        start_time=entry.start_time,
+        end_time=entry.end_time,
+        duration_minutes=entry.duration_minutes,
+        ps5_setup=entry.ps5_setup,
+        controllers=entry.controllers,
+        base_price=pricing["base_price"],
+        controller_charges=pricing["controller_charges"],
+        total_price=pricing["total_price"],
+        payment_method=entry.payment_method,
+        payment_status="completed"
+    )
+    await save_booking(booking)
+    
+    await db.waitlist.update_one(
+        {"id": entry.id},
+        {"$set": {"status": "allocated", "booking_id": booking.id}}
+    )
+    return booking
+
+# Entries in these states hold the user's place for a slot
+ACTIVE_WAITLIST_STATUSES = ["waiting", "allocating", "allocated"]
+
+async def allocate_waitlist(date: str, ps5_setup: int) -> List[Booking]:
+    """Give free capacity on a date/setup to waiting customers, first come first served
+
+    Waiters who can't pay when their slot frees up are marked 'unfunded'.
+    Callers must hold slot_lock(date, ps5_setup).
+    """
+    allocated = []
+    waiting = await db.waitlist.find(
+        {"date": date, "ps5_setup": ps5_setup, "status": "waiting"}
+    ).sort("created_at", 1).to_list(500)
+    if not waiting:
+        return allocated
+    
+    occupied_slots = await get_occupied_slots(date, ps5_setup)
+    for entry in waiting:
+        if not slot_is_free(entry["start_time"], entry["end_time"], occupied_slots):
+            continue
+        
+        booking = await book_waitlist_entry(WaitlistEntry(**entry))
+        if booking:
+            occupied_slots.append({"start_time": booking.start_time, "end_time": booking.end_time})
+            allocated.append(booking)
+    
+    if allocated:
+        logger.info(f"Allocated {len(allocated)} waitlist entries for {date} setup {ps5_setup}")
+    return allocated
+
+@api_router.post("/waitlist")
+async def join_waitlist(
+    booking_data: BookingCreate,
+    user: User = Depends(get_current_user)
+):
+    """Queue for a slot; it is booked automatically when capacity frees up"""
+    validate_booking_request(booking_data)
+    
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    if booking_data.date < today:
+        raise HTTPException(status_code=400, detail="Cannot join the waitlist for a past date")
+    
+    end_time = calculate_end_time(booking_data.start_time, booking_data.duration_minutes)
+    
+    # One active entry per user per slot (also enforced by a unique index), so retries don't pile up
+    slot_query = {
+        "user_id": user.id,
+        "date": booking_data.date,
+        "ps5_setup": booking_data.ps5_setup,
+        "start_time": booking_data.start_time,
+        "end_time": end_time,
+        "status": {"$in": ACTIVE_WAITLIST_STATUSES}
+    }
+    existing = await db.waitlist.find_one(slot_query)
+    if existing:
+        return WaitlistEntry(**existing)
+    
+    entry = WaitlistEntry(
+        user_id=user.id,
+        user_name=user.name,
+        user_email=user.email,
+        date=booking_data.date,
+        start_time=booking_data.start_time,
+        end_time=end_time,
+        duration_minutes=booking_data.duration_minutes,
+        ps5_setup=booking_data.ps5_setup,
+        controllers=booking_data.controllers,
+        payment_method=booking_data.payment_method
+    )
+    async with slot_lock(entry.date, entry.ps5_setup):
+        # Serve the existing queue first, then only queue for slots that are actually taken
+        await allocate_waitlist(entry.date, entry.ps5_setup)
+        occupied_slots = await get_occupied_slots(entry.date, entry.ps5_setup)
+        if slot_is_free(entry.start_time, entry.end_time, occupied_slots):
+            raise HTTPException(status_code=400, detail="Time slot is available, book it directly")
+        
+        try:
+            await db.waitlist.insert_one(entry.dict())
+        except DuplicateKeyError:
+            # A concurrent retry from the same user got there first
+            existing = await db.waitlist.find_one(slot_query)
+            return WaitlistEntry(**existing)
+    
+    return entry
+
+@api_router.get("/waitlist/mine")
+async def get_my_waitlist(user: User = Depends(get_current_user)):
+    """Get current user's waitlist entries"""
+    entries = await db.waitlist.find(
+        {"user_id": user.id}
+    ).sort("created_at", -1).to_list(100)
+    
+    return [WaitlistEntry(**entry) for entry in entries]
+
+@api_router.delete("/waitlist/{entry_id}")
+async def leave_waitlist(entry_id: str, user: User = Depends(get_current_user)):
+    """Withdraw a waiting entry"""
+    result = await db.waitlist.update_one(
+        {"id": entry_id, "user_id": user.id, "status": "waiting"},
+        {"$set": {"status": "cancelled"}}
+    )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=404, detail="Waitlist entry not found")
+    
+    return {"message": "Removed from waitlist"}
+
+# ========= DASHBOARD ROUTES =========
+
+DASHBOARD_SECTIONS = ("upcoming_bookings", "recent_transactions", "availability")
+
+@api_router.get("/dashboard")
+async def get_dashboard(
+    request: Request,
+    response: Response,
+    date: Optional[str] = None,
+    include: Optional[str] = None,
+    user: User = Depends(get_current_user)
+):
+    """Get the user, balance and the requested sections (comma-separated, default all) in one request"""
+    sections = DASHBOARD_SECTIONS
+    if include:
+        sections = tuple(section for section in DASHBOARD_SECTIONS if section in include.split(","))
+    
+    # Availability changes with other users' bookings, so only per-user payloads are cacheable
+    if "availability" not in sections:
+        cached = not_modified(request, response, user, "dashboard-" + "+".join(sections))
+        if cached:
+            return cached
+    
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    date = date or today
+    
+    queries = {}
+    if "upcoming_bookings" in sections:
+        queries["upcoming_bookings"] = db.bookings.find(
+            {"user_id": user.id, "date": {"$gte": today}, "status": {"$ne": "cancelled"}}
+        ).sort([("date", 1), ("start_time", 1)]).to_list(20)
+    if "recent_transactions" in sections:
+        queries["recent_transactions"] = db.wallet_transactions.find(
+            {"user_id": user.id}
+        ).sort("timestamp", -1).to_list(10)
+    if "availability" in sections:
+        queries["setup_1_slots"] = get_occupied_slots(date, 1)
+        queries["setup_2_slots"] = get_occupied_slots(date, 2)
+    
+    results = dict(zip(queries, await asyncio.gather(*queries.values())))
+    
+    payload = {
+        "user": user,
+        "balance": user.wallet_balance
+    }
+    if "upcoming_bookings" in sections:
+        payload["upcoming_bookings"] = [Booking(**booking) for booking in results["upcoming_bookings"]]
+    if "recent_transactions" in sections:
+        payload["recent_transactions"] = [WalletTransaction(**txn) for txn in results["recent_transactions"]]
+    if "availability" in sections:
+        payload["availability"] = {
+            "date": date,
+            "setups": {
+                "1": results["setup_1_slots"],
+                "2": results["setup_2_slots"]
+            }
+        }
+    
+    return payload
+
 # ========= ADMIN ROUTES =========
 
 @api_router.get("/admin/bookings")
 async def get_all_bookings(
     date: Optional[str] = None,
+    include_history: bool = False,
     user: User = Depends(get_current_user)
 ):
     """Get all bookings (admin only)"""
@@ -461,27 +864,44 @@ async def get_all_bookings(
     query = {}
     if date:
         query["date"] = date
+        # Asking for an already-archived day is an explicit history request
+        if date < archive_cutoff().strftime('%Y-%m-%d'):
+            include_history = True
     
-    bookings = await db.bookings.find(query).sort("date", -1).to_list(1000)
+    bookings = await find_with_history("bookings", query, "date", -1, 1000, include_history)
     
     return [Booking(**booking) for booking in bookings]
 
+async def sum_revenue(collection: str) -> float:
+    """Total price of non-cancelled bookings in a collection"""
+    result = await db[collection].aggregate([
+        {"$match": {"status": {"$ne": "cancelled"}}},
+        {"$group": {"_id": None, "total": {"$sum": "$total_price"}}}
+    ]).to_list(1)
+    return result[0]["total"] if result else 0.0
+
 @api_router.get("/admin/stats")
 async def get_admin_stats(user: User = Depends(get_current_user)):
     """Get admin dashboard stats"""
     if not user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    total_bookings = await db.bookings.count_documents({})
+    active = {"status": {"$ne": "cancelled"}}
+    total_bookings = await db.bookings.count_documents(active)
     total_users = await db.users.count_documents({})
     
     # Calculate today's bookings
     today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-    today_bookings = await db.bookings.count_documents({"date": today})
+    today_bookings = await db.bookings.count_documents({**active, "date": today})
     
     # Calculate total revenue
-    bookings = await db.bookings.find().to_list(10000)
-    total_revenue = sum(booking["total_price"] for booking in bookings)
+    total_revenue = await sum_revenue("bookings")
+    
+    # Archived bookings are counted from the running totals run_archival keeps
+    archived = await db.archive_totals.find_one({"_id": "bookings"})
+    if archived:
+        total_bookings += archived["count"]
+        total_revenue += archived["revenue"]
     
     return {
         "total_bookings": total_bookings,
@@ -490,9 +910,295 @@ async def get_admin_stats(user: User = Depends(get_current_user)):
         "total_revenue": round(total_revenue, 2)
     }
 
+# ========= ARCHIVAL =========
+
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get('ARCHIVE_INTERVAL_HOURS', '24'))
+ARCHIVE_BATCH_SIZE = 1000
+
+async def archive_collection(collection: str, query: dict) -> set:
+    """Move matching documents to the archive collection; returns the affected user ids"""
+    user_ids = set()
+    while True:
+        docs = await db[collection].find(query).to_list(ARCHIVE_BATCH_SIZE)
+        if not docs:
+            return user_ids
+        
+        # Upsert by _id so a run interrupted before the delete can safely be repeated
+        await db[f"{collection}_archive"].bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs],
+            ordered=False
+        )
+        await db[collection].delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        user_ids.update(doc["user_id"] for doc in docs)
+
+async def refresh_archive_totals():
+    """Recompute the archived booking count/revenue that admin stats add to the hot totals
+
+    Derived from bookings_archive itself, so a run interrupted mid-batch can't leave it short.
+    """
+    result = await db.bookings_archive.aggregate([
+        {"$match": {"status": {"$ne": "cancelled"}}},
+        {"$group": {"_id": None, "count": {"$sum": 1}, "revenue": {"$sum": "$total_price"}}}
+    ]).to_list(1)
+    totals = result[0] if result else {"count": 0, "revenue": 0.0}
+    await db.archive_totals.replace_one(
+        {"_id": "bookings"},
+        {"count": totals["count"], "revenue": totals["revenue"]},
+        upsert=True
+    )
+
+async def run_archival():
+    """Move old bookings and transactions out of the hot collections"""
+    cutoff = archive_cutoff()
+    
+    booking_users = await archive_collection(
+        "bookings", {"date": {"$lt": cutoff.strftime('%Y-%m-%d')}}
+    )
+    transaction_users = await archive_collection(
+        "wallet_transactions", {"timestamp": {"$lt": cutoff}}
+    )
+    
+    if booking_users or not await db.archive_totals.find_one({"_id": "bookings"}):
+        await refresh_archive_totals()
+    
+    # Waiting entries for days that have passed can never be served
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    await db.waitlist.update_many(
+        {"status": "waiting", "date": {"$lt": today}},
+        {"$set": {"status": "expired"}}
+    )
+    
+    # Cached non-history lists for these users no longer match the hot collections
+    user_ids = list(booking_users | transaction_users)
+    if user_ids:
+        await db.users.update_many({"id": {"$in": user_ids}}, {"$inc": {"data_version": 1}})
+    
+    logger.info(f"Archival moved data for {len(user_ids)} users older than {cutoff.date()}")
+
+async def archival_loop():
+    """Run archival once per interval across all workers"""
+    while True:
+        try:
+            async with shared_state.lock("archival", timeout=3600):
+                if not await shared_state.get("archival:done"):
+                    await run_archival()
+                    await shared_state.set(
+                        "archival:done",
+                        datetime.now(timezone.utc).isoformat(),
+                        ttl=ARCHIVE_INTERVAL_HOURS * 3600
+                    )
+        except Exception as e:
+            logger.error(f"Archival failed: {e}")
+        
+        await asyncio.sleep(min(ARCHIVE_INTERVAL_HOURS * 3600, 3600))
+
+# ========= RATE LIMITING =========
+
+class RateLimitRule(NamedTuple):
+    rate: float  # tokens refilled per second
+    burst: int  # bucket capacity
+    scope: str  # 'user' (session token, falls back to IP) or 'ip'
+
+# Per-route limits keyed by (method, path); anything else under /api uses the default
+RATE_LIMIT_RULES: Dict[tuple, RateLimitRule] = {
+    ("GET", "/api/bookings/availability"): RateLimitRule(rate=2, burst=20, scope="ip"),
+    ("GET", "/api/bookings/calculate-price"): RateLimitRule(rate=2, burst=20, scope="ip"),
+    ("POST", "/api/auth/session"): RateLimitRule(rate=0.2, burst=5, scope="ip"),
+    ("POST", "/api/bookings"): RateLimitRule(rate=0.5, burst=5, scope="user"),
+    ("POST", "/api/wallet/topup"): RateLimitRule(rate=0.5, burst=5, scope="user"),
+    ("POST", "/api/waitlist"): RateLimitRule(rate=0.5, burst=5, scope="user"),
+}
+DEFAULT_RATE_LIMIT = RateLimitRule(rate=5, burst=50, scope="user")
+
+# User-scoped routes also get a per-IP bucket this many times larger, since the session
+# cookie isn't validated here and a client could otherwise rotate it for fresh buckets
+USER_SCOPE_IP_FACTOR = 10
+
+class InMemoryRateLimitStore:
+    """Token buckets held in process memory (one worker only)"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self._buckets: Dict[str, tuple] = {}
+        self._max_keys = max_keys
+
+    async def take(self, key: str, rule: RateLimitRule) -> float:
+        """Consume one token; return 0 if allowed, else seconds until a token is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._max_keys:
+                self._prune(now)
+            tokens = float(rule.burst)
+        else:
+            tokens = min(rule.burst, bucket[0] + (now - bucket[1]) * rule.rate)
+        
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+        
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) / rule.rate
+
+    def _prune(self, now: float):
+        """Drop buckets idle long enough to have refilled completely"""
+        idle_after = max(r.burst / r.rate for r in [DEFAULT_RATE_LIMIT, *RATE_LIMIT_RULES.values()])
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if now - bucket[1] < idle_after
+        }
+        if len(self._buckets) >= self._max_keys:
+            # Still full: evict the least recently used half rather than resetting everyone
+            recent = sorted(self._buckets.items(), key=lambda item: item[1][1], reverse=True)
+            self._buckets = dict(recent[:self._max_keys // 2])
+
+class RedisRateLimitStore:
+    """Token buckets shared across workers/nodes via Redis (atomic Lua script)"""
+
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    local retry_after = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        retry_after = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(retry_after)
+    """
+
+    def __init__(self, state: RedisState):
+        self._prefix = state.prefix
+        self._script = state.redis.register_script(self.SCRIPT)
+
+    async def take(self, key: str, rule: RateLimitRule) -> float:
+        result = await self._script(
+            keys=[f"{self._prefix}ratelimit:{key}"],
+            args=[rule.rate, rule.burst, time.time()]
+        )
+        return float(result)
+
+class RateLimitMiddleware:
+    """ASGI middleware enforcing token-bucket limits per user or client IP"""
+
+    def __init__(self, app, store, routes=(), trusted_hops: int = 0):
+        self.app = app
+        self.store = store
+        # Used to key buckets on the route template, so ids in the path share one bucket
+        self.routes = routes
+        # Number of proxies in front of the app that append to X-Forwarded-For
+        self.trusted_hops = trusted_hops
+
+    def _route_path(self, scope) -> str:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                return route.path
+        return "<unmatched>"
+
+    def _client_ip(self, scope) -> str:
+        if self.trusted_hops:
+            forwarded = [
+                entry.strip()
+                for name, value in scope["headers"] if name == b"x-forwarded-for"
+                for entry in value.decode("latin-1").split(",")
+            ]
+            if forwarded:
+                # Entries left of the one our outermost trusted proxy appended are client-controlled
+                return forwarded[max(0, len(forwarded) - self.trusted_hops)]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def _session_key(self, scope) -> Optional[str]:
+        """Hash of the session_token cookie, the only credential the app authenticates with"""
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                for part in value.decode("latin-1").split(";"):
+                    cookie_name, _, cookie_value = part.strip().partition("=")
+                    if cookie_name == "session_token" and cookie_value:
+                        return hashlib.sha256(cookie_value.encode()).hexdigest()[:32]
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/") or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        
+        path = self._route_path(scope)
+        rule = RATE_LIMIT_RULES.get((scope["method"], path), DEFAULT_RATE_LIMIT)
+        ip_key = f"ip:{self._client_ip(scope)}:{path}"
+        session_key = self._session_key(scope) if rule.scope == "user" else None
+        
+        try:
+            if session_key:
+                ip_rule = RateLimitRule(
+                    rule.rate * USER_SCOPE_IP_FACTOR, rule.burst * USER_SCOPE_IP_FACTOR, "ip"
+                )
+                retry_after = await self.store.take(ip_key, ip_rule)
+                if not retry_after:
+                    retry_after = await self.store.take(f"user:{session_key}:{path}", rule)
+            else:
+                retry_after = await self.store.take(ip_key, rule)
+        except Exception as e:
+            # Never take the API down because the limiter store is unreachable
+            logger.warning(f"Rate limit store error: {e}")
+            retry_after = 0.0
+        
+        if retry_after > 0:
+            response = JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={"detail": "Too many requests"},
+                headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+            )
+            await response(scope, receive, send)
+            return
+        
+        await self.app(scope, receive, send)
+
+def create_rate_limit_store():
+    """Share buckets through Redis when the app runs with a Redis backend, otherwise in-memory"""
+    if isinstance(shared_state, RedisState):
+        return RedisRateLimitStore(shared_state)
+    return InMemoryRateLimitStore()
+
 # Include the router in the main app
 app.include_router(api_router)
 
+if PROFILING_ENABLED:
+    app.add_middleware(
+        ProfilingMiddleware,
+        database=client[os.environ['DB_NAME']],
+        output_dir=os.environ.get('PROFILING_DIR', str(ROOT_DIR / 'profiles')),
+        sample_rate=float(os.environ.get('PROFILING_SAMPLE_RATE', '0')),
+        token=os.environ.get('PROFILING_TOKEN'),
+    )
+
+if os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true':
+    app.add_middleware(
+        RateLimitMiddleware,
+        store=create_rate_limit_store(),
+        routes=app.routes,
+        trusted_hops=int(os.environ.get('RATE_LIMIT_TRUSTED_HOPS', '1')),
+    )
+
+def add_compression_middleware(app: FastAPI):
+    """Brotli (with gzip fallback) when brotli-asgi is installed, plain gzip otherwise"""
+    minimum_size = int(os.environ.get('COMPRESSION_MIN_SIZE', '1000'))
+    try:
+        from brotli_asgi import BrotliMiddleware
+    except ImportError:
+        app.add_middleware(GZipMiddleware, minimum_size=minimum_size)
+    else:
+        app.add_middleware(BrotliMiddleware, minimum_size=minimum_size, gzip_fallback=True)
+
+add_compression_middleware(app)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -501,6 +1207,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def ensure_indexes():
+    # Archival selects by these fields in batches; without indexes each batch scans the collection
+    await db.bookings.create_index("date")
+    await db.wallet_transactions.create_index("timestamp")
+    
+    # One active waitlist entry per user per slot ($in partial filters need MongoDB 6.0+)
+    await db.waitlist.create_index(
+        [("user_id", 1), ("date", 1), ("ps5_setup", 1), ("start_time", 1), ("end_time", 1)],
+        unique=True,
+        partialFilterExpression={"status": {"$in": ACTIVE_WAITLIST_STATUSES}},
+        name="waitlist_active_slot_unique"
+    )
+
+@app.on_event("startup")
+async def start_archival():
+    if os.environ.get('ARCHIVE_ENABLED', 'true').lower() == 'true':
+        app.state.archival_task = asyncio.create_task(archival_loop())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    archival_task = getattr(app.state, "archival_task", None)
+    if archival_task:
+        archival_task.cancel()
+    client.close()
+    await shared_state.close()
\ No newline at end of file
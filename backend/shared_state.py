@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# ========= SHARED STATE =========
+#
+# State that must agree across uvicorn workers (cache entries, counters, locks,
+# pub/sub) goes through one of these backends instead of module globals.
+# InProcessState is correct for a single worker; RedisState works across
+# workers on one box and across nodes.
+
+class SharedState(ABC):
+    """Interface implemented by every backend"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    async def incr(self, key: str, amount: int = 1) -> int:
+        ...
+
+    @abstractmethod
+    def lock(self, name: str, timeout: float = 10):
+        """Async context manager held by at most one caller at a time, released after timeout seconds"""
+
+    @abstractmethod
+    async def publish(self, channel: str, message: str):
+        ...
+
+    @abstractmethod
+    def subscribe(self, channel: str) -> AsyncIterator[str]:
+        ...
+
+    async def close(self):
+        pass
+
+class InProcessLock:
+    """Lease-style asyncio lock: like a Redis lock, it is released automatically after timeout"""
+
+    def __init__(self, locks: Dict[str, List], name: str, timeout: float):
+        self._locks = locks
+        self._name = name
+        self._timeout = timeout
+        self._entry = None
+        self._held = False
+        self._expiry = None
+
+    async def __aenter__(self):
+        # Entries are [lock, number of users] so idle locks can be dropped
+        self._entry = self._locks.setdefault(self._name, [asyncio.Lock(), 0])
+        self._entry[1] += 1
+        try:
+            await self._entry[0].acquire()
+        except BaseException:
+            self._drop_reference()
+            raise
+        self._held = True
+        self._expiry = asyncio.get_running_loop().call_later(self._timeout, self._expire)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._expiry.cancel()
+        self._release()
+        self._drop_reference()
+
+    def _expire(self):
+        logger.warning(f"Lock {self._name} held longer than {self._timeout}s; releasing")
+        self._release()
+
+    def _release(self):
+        if self._held:
+            self._held = False
+            self._entry[0].release()
+
+    def _drop_reference(self):
+        self._entry[1] -= 1
+        if self._entry[1] == 0 and self._locks.get(self._name) is self._entry:
+            del self._locks[self._name]
+
+class InProcessState(SharedState):
+    """Backend for a single worker process"""
+
+    def __init__(self):
+        self._values: Dict[str, tuple] = {}
+        self._locks: Dict[str, List] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._values[key] = (value, expires_at)
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        value = int(await self.get(key) or 0) + amount
+        expires_at = self._values[key][1] if key in self._values else None
+        self._values[key] = (str(value), expires_at)
+        return value
+
+    def lock(self, name: str, timeout: float = 10):
+        return InProcessLock(self._locks, name, timeout)
+
+    async def publish(self, channel: str, message: str):
+        for queue in self._subscribers.get(channel, ()):
+            queue.put_nowait(message)
+
+    async def subscribe(self, channel: str) -> AsyncIterator[str]:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers[channel].add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers[channel].discard(queue)
+            if not self._subscribers[channel]:
+                del self._subscribers[channel]
+
+class RedisState(SharedState):
+    """Backend for any Redis-compatible server (Redis, Valkey, KeyDB, ...)"""
+
+    def __init__(self, url: str, prefix: str = "trongaming:"):
+        import redis.asyncio as redis
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.redis.get(self.prefix + key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self.redis.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, key: str):
+        await self.redis.delete(self.prefix + key)
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        return await self.redis.incrby(self.prefix + key, amount)
+
+    def lock(self, name: str, timeout: float = 10):
+        return self.redis.lock(f"{self.prefix}lock:{name}", timeout=timeout)
+
+    async def publish(self, channel: str, message: str):
+        await self.redis.publish(self.prefix + channel, message)
+
+    async def subscribe(self, channel: str) -> AsyncIterator[str]:
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(self.prefix + channel)
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    yield message["data"]
+        finally:
+            await pubsub.unsubscribe(self.prefix + channel)
+            await pubsub.aclose()
+
+    async def close(self):
+        await self.redis.aclose()
+
+def create_shared_state(redis_url: Optional[str] = None) -> SharedState:
+    """Use Redis when a URL is configured, otherwise keep state in this process"""
+    if redis_url:
+        return RedisState(redis_url)
+    return InProcessState()
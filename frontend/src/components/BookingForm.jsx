@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { Button } from './ui/button';
@@ -23,13 +23,14 @@ export const BookingForm = () => {
   const [walletBalance, setWalletBalance] = useState(0);
   const [loading, setLoading] = useState(false);
   const [availability, setAvailability] = useState([]);
+  const initialLoad = useRef(true);
 
   useEffect(() => {
-    fetchWalletBalance();
-  }, []);
-
-  useEffect(() => {
-    if (date && ps5Setup) {
+    if (initialLoad.current) {
+      // The dashboard payload already carries today's availability
+      initialLoad.current = false;
+      fetchDashboard();
+    } else if (date && ps5Setup) {
       checkAvailability();
     }
   }, [date, ps5Setup]);
@@ -38,12 +39,17 @@ export const BookingForm = () => {
     calculatePrice();
   }, [duration, controllers]);
 
-  const fetchWalletBalance = async () => {
+  const fetchDashboard = async () => {
     try {
-      const response = await axios.get(`${API}/wallet/balance`, { withCredentials: true });
+      const formattedDate = date.toISOString().split('T')[0];
+      const response = await axios.get(`${API}/dashboard`, {
+        params: { date: formattedDate, include: 'availability' },
+        withCredentials: true
+      });
       setWalletBalance(response.data.balance);
+      setAvailability(response.data.availability.setups[ps5Setup]);
     } catch (error) {
-      console.error('Error fetching wallet balance:', error);
+      console.error('Error fetching dashboard:', error);
     }
   };
 
@@ -18,6 +18,8 @@ export const Dashboard = () => {
     fetchUserData();
   }, []);
 
+  // Stays on /auth/me and /wallet/balance rather than /dashboard: it only renders the
+  // user and balance, and both endpoints answer repeat visits with 304 via their ETags
   const fetchUserData = async () => {
     try {
       const response = await axios.get(`${API}/auth/me`, { withCredentials: true });
@@ -0,0 +1,19 @@
+import sys
+from pathlib import Path
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from shared_state import InProcessState  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Point the app at a fresh in-memory Mongo and shared state for each test"""
+    database = AsyncMongoMockClient()["test_database"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "shared_state", InProcessState())
+    return database
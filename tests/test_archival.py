@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+
+
+def old_booking(price, status="confirmed"):
+    old_date = (datetime.now(timezone.utc) - timedelta(days=server.ARCHIVE_AFTER_DAYS + 5)).strftime('%Y-%m-%d')
+    return server.Booking(
+        user_id="user_a", user_name="a", user_email="a@example.com",
+        date=old_date, start_time="18:00", end_time="19:00", duration_minutes=60,
+        ps5_setup=1, controllers=1, base_price=price, controller_charges=0,
+        total_price=price, payment_method="mock", status=status,
+    ).dict()
+
+
+def test_archival_moves_old_bookings_and_totals_them(db):
+    async def scenario():
+        await db.users.insert_one({"id": "user_a", "data_version": 0})
+        await db.bookings.insert_many([old_booking(100), old_booking(50, status="cancelled")])
+
+        await server.run_archival()
+
+        assert await db.bookings.count_documents({}) == 0
+        assert await db.bookings_archive.count_documents({}) == 2
+        totals = await db.archive_totals.find_one({"_id": "bookings"})
+        assert (totals["count"], totals["revenue"]) == (1, 100)
+        assert (await db.users.find_one({"id": "user_a"}))["data_version"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_totals_recover_after_interrupted_batch(db):
+    async def scenario():
+        doc = old_booking(100)
+        # Copied to the archive but not yet deleted or totalled, as if the run crashed
+        await db.bookings.insert_one(doc)
+        await db.bookings_archive.insert_one(dict(doc))
+
+        await server.run_archival()
+
+        totals = await db.archive_totals.find_one({"_id": "bookings"})
+        assert (totals["count"], totals["revenue"]) == (1, 100)
+        assert await db.bookings_archive.count_documents({}) == 1
+
+    asyncio.run(scenario())
+
+
+def test_past_waitlist_entries_expire(db):
+    async def scenario():
+        await db.waitlist.insert_one({"id": "wait_1", "date": "2000-01-01", "status": "waiting"})
+        await server.run_archival()
+        assert (await db.waitlist.find_one({"id": "wait_1"}))["status"] == "expired"
+
+    asyncio.run(scenario())
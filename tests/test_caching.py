@@ -0,0 +1,48 @@
+from starlette.requests import Request
+from starlette.responses import Response
+
+import server
+
+USER = server.User(id="user_abc", email="player@example.com", name="player", data_version=3)
+
+
+def make_request(if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/api/wallet/balance", "headers": headers})
+
+
+def current_etag(resource="balance", user=USER):
+    response = Response()
+    assert server.not_modified(make_request(), response, user, resource) is None
+    return response.headers["etag"]
+
+
+def test_etag_is_weak_and_versioned():
+    etag = current_etag()
+    assert etag.startswith('W/"')
+    assert server.APP_VERSION in etag
+    assert "user_abc" in etag and etag.endswith('-3"')
+
+
+def test_matching_tag_returns_304():
+    etag = current_etag()
+    cached = server.not_modified(make_request(etag), Response(), USER, "balance")
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+
+
+def test_strong_form_and_lists_match_weakly():
+    opaque = current_etag().removeprefix("W/")
+    assert server.not_modified(make_request(opaque), Response(), USER, "balance").status_code == 304
+    listed = f'"stale", {current_etag()}'
+    assert server.not_modified(make_request(listed), Response(), USER, "balance").status_code == 304
+    assert server.not_modified(make_request("*"), Response(), USER, "balance").status_code == 304
+
+
+def test_stale_or_foreign_tags_fall_through():
+    stale = current_etag(user=USER.model_copy(update={"data_version": 2}))
+    other_resource = current_etag(resource="transactions")
+    for tag in (stale, other_resource, '"garbage"'):
+        response = Response()
+        assert server.not_modified(make_request(tag), response, USER, "balance") is None
+        assert response.headers["etag"] == current_etag()
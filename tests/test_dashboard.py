@@ -0,0 +1,53 @@
+import asyncio
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+import server
+
+
+def make_request(headers=None):
+    raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/api/dashboard", "headers": raw_headers})
+
+
+async def make_user(db):
+    user = server.User(email="player@example.com", name="player", wallet_balance=250.0)
+    await db.users.insert_one(user.dict())
+    return user
+
+
+def test_include_limits_sections(db):
+    async def scenario():
+        user = await make_user(db)
+        payload = await server.get_dashboard(
+            make_request(), Response(), date="2030-01-01", include="availability", user=user
+        )
+        assert set(payload) == {"user", "balance", "availability"}
+        assert payload["balance"] == 250.0
+
+    asyncio.run(scenario())
+
+
+def test_defaults_to_all_sections(db):
+    async def scenario():
+        user = await make_user(db)
+        payload = await server.get_dashboard(make_request(), Response(), date=None, include=None, user=user)
+        assert set(payload) == {"user", "balance", *server.DASHBOARD_SECTIONS}
+
+    asyncio.run(scenario())
+
+
+def test_per_user_sections_revalidate_with_etag(db):
+    async def scenario():
+        user = await make_user(db)
+        response = Response()
+        await server.get_dashboard(make_request(), response, date=None, include="upcoming_bookings", user=user)
+        etag = response.headers["etag"]
+
+        cached = await server.get_dashboard(
+            make_request({"If-None-Match": etag}), Response(), date=None, include="upcoming_bookings", user=user
+        )
+        assert cached.status_code == 304
+
+    asyncio.run(scenario())
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import sys
+
+from mongomock_motor import AsyncMongoMockClient
+from starlette.responses import PlainTextResponse
+from starlette.testclient import TestClient
+
+from profiling import (
+    CPUProfile,
+    ProfiledCollection,
+    ProfilingMiddleware,
+    captured_queries,
+    explain_query,
+)
+
+
+class RecordingDatabase:
+    def __init__(self):
+        self.commands = []
+
+    async def command(self, command):
+        self.commands.append(command)
+        return {}
+
+
+def capture(operation):
+    async def scenario():
+        collection = ProfiledCollection(AsyncMongoMockClient()["test_database"]["bookings"])
+        queries = []
+        token = captured_queries.set(queries)
+        try:
+            await operation(collection)
+        finally:
+            captured_queries.reset(token)
+        return queries
+
+    return asyncio.run(scenario())
+
+
+def test_find_records_projection_sort_and_to_list_limit():
+    queries = capture(
+        lambda bookings: bookings.find({"user_id": "u"}, {"_id": 0}).sort("created_at", -1).to_list(100)
+    )
+    assert queries == [{
+        "collection": "bookings",
+        "operation": "find",
+        "query": {"user_id": "u"},
+        "projection": {"_id": 0},
+        "sort": {"created_at": -1},
+        "limit": 100,
+    }]
+
+
+def test_explicit_limit_below_to_list_length_is_kept():
+    queries = capture(lambda bookings: bookings.find({}).limit(5).to_list(100))
+    assert queries[0]["limit"] == 5
+
+
+def test_explain_uses_the_full_find_shape():
+    database = RecordingDatabase()
+    query = {
+        "collection": "bookings", "operation": "find", "query": {"user_id": "u"},
+        "sort": {"date": 1, "start_time": 1}, "limit": 20,
+    }
+    asyncio.run(explain_query(database, query))
+    assert database.commands == [{
+        "explain": {
+            "find": "bookings", "filter": {"user_id": "u"},
+            "sort": {"date": 1, "start_time": 1}, "limit": 20,
+        },
+        "verbosity": "executionStats",
+    }]
+
+
+def test_queries_are_not_recorded_outside_a_profile():
+    async def scenario():
+        collection = ProfiledCollection(AsyncMongoMockClient()["test_database"]["bookings"])
+        await collection.find({}).to_list(10)
+        assert captured_queries.get() is None
+
+    asyncio.run(scenario())
+
+
+def test_x_profile_header_requires_the_token():
+    middleware = ProfilingMiddleware(None, database=None, output_dir="/tmp", sample_rate=0, token="secret")
+    assert middleware._profile_reason({"headers": [(b"x-profile", b"1")]}) is None
+    assert middleware._profile_reason({"headers": [(b"x-profile", b"secret")]}) == "flagged"
+
+    tokenless = ProfilingMiddleware(None, database=None, output_dir="/tmp", sample_rate=0)
+    assert tokenless._profile_reason({"headers": [(b"x-profile", b"1")]}) is None
+
+
+def test_sampled_requests_do_not_fall_back_to_cprofile(monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyinstrument", None)
+    assert CPUProfile(allow_cprofile=False).kind is None
+    profile = CPUProfile(allow_cprofile=True)
+    assert profile.kind == "cprofile"
+    profile.start()
+    profile.stop()
+
+
+def test_flagged_request_writes_summary_with_explains(tmp_path):
+    bookings = ProfiledCollection(AsyncMongoMockClient()["test_database"]["bookings"])
+
+    async def app(scope, receive, send):
+        await bookings.find({"date": "2030-01-01"}).to_list(10)
+        await PlainTextResponse("ok")(scope, receive, send)
+
+    database = RecordingDatabase()
+    middleware = ProfilingMiddleware(app, database=database, output_dir=str(tmp_path), token="secret")
+    assert TestClient(middleware).get("/api/x", headers={"X-Profile": "secret"}).status_code == 200
+
+    [directory] = tmp_path.iterdir()
+    summary = json.loads((directory / "request.json").read_text())
+    assert summary["reason"] == "flagged"
+    assert summary["status_code"] == 200
+    assert summary["queries"][0]["limit"] == 10
+    assert database.commands[0]["explain"]["filter"] == {"date": "2030-01-01"}
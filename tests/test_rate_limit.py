@@ -0,0 +1,121 @@
+import asyncio
+import uuid
+
+from starlette.responses import PlainTextResponse
+from starlette.testclient import TestClient
+
+import server
+from server import InMemoryRateLimitStore, RateLimitMiddleware, RateLimitRule
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def ok_app(scope, receive, send):
+    await PlainTextResponse("ok")(scope, receive, send)
+
+
+def limited_client(trusted_hops=1):
+    middleware = RateLimitMiddleware(
+        ok_app, store=InMemoryRateLimitStore(), routes=server.app.routes, trusted_hops=trusted_hops
+    )
+    return TestClient(middleware)
+
+
+def test_take_allows_burst_then_reports_retry_after(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    store = InMemoryRateLimitStore()
+    rule = RateLimitRule(rate=2, burst=3, scope="ip")
+
+    async def scenario():
+        assert [await store.take("k", rule) for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert await store.take("k", rule) == 0.5
+
+        clock.now += 0.5
+        assert await store.take("k", rule) == 0.0
+
+    asyncio.run(scenario())
+
+
+def test_prune_evicts_least_recently_used_instead_of_clearing(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    store = InMemoryRateLimitStore(max_keys=4)
+    rule = RateLimitRule(rate=1, burst=5, scope="ip")
+
+    async def scenario():
+        for key in ["a", "b", "c", "d"]:
+            clock.now += 0.01
+            await store.take(key, rule)
+        # Touch "a" again so it is the most recently used
+        clock.now += 0.01
+        for _ in range(4):
+            await store.take("a", rule)
+
+        clock.now += 0.01
+        await store.take("e", rule)
+        assert set(store._buckets) == {"a", "d", "e"}
+        # "a" kept its drained bucket rather than being reset
+        assert await store.take("a", rule) > 0
+
+    asyncio.run(scenario())
+
+
+def test_over_limit_returns_429_with_retry_after():
+    client = limited_client()
+    for _ in range(20):
+        assert client.get("/api/bookings/calculate-price").status_code == 200
+
+    response = client.get("/api/bookings/calculate-price")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_ip_is_taken_from_trusted_forwarded_hop():
+    client = limited_client(trusted_hops=1)
+    for _ in range(20):
+        client.get("/api/bookings/calculate-price", headers={"X-Forwarded-For": "1.1.1.1, 9.9.9.9"})
+
+    # Spoofing the left-most entry doesn't give a new bucket
+    response = client.get("/api/bookings/calculate-price", headers={"X-Forwarded-For": "2.2.2.2, 9.9.9.9"})
+    assert response.status_code == 429
+    # A different client behind the proxy has its own bucket
+    response = client.get("/api/bookings/calculate-price", headers={"X-Forwarded-For": "8.8.8.8"})
+    assert response.status_code == 200
+
+
+def test_user_bucket_is_keyed_on_session_cookie_only():
+    client = limited_client()
+    client.cookies.set("session_token", "session-a")
+    for _ in range(5):
+        assert client.post("/api/bookings").status_code == 200
+
+    # A random Authorization header doesn't open a fresh bucket
+    response = client.post("/api/bookings", headers={"Authorization": f"Bearer {uuid.uuid4()}"})
+    assert response.status_code == 429
+
+
+def test_rotating_session_cookies_hit_the_ip_backstop():
+    client = limited_client()
+    statuses = []
+    for _ in range(60):
+        client.cookies.set("session_token", uuid.uuid4().hex)
+        statuses.append(client.post("/api/bookings").status_code)
+
+    assert statuses.count(200) == 5 * server.USER_SCOPE_IP_FACTOR
+    assert statuses[-1] == 429
+
+
+def test_path_ids_share_the_route_template_bucket():
+    client = limited_client()
+    statuses = [
+        client.post(f"/api/bookings/booking_{uuid.uuid4().hex[:12]}/cancel").status_code
+        for _ in range(server.DEFAULT_RATE_LIMIT.burst + 1)
+    ]
+    assert statuses[-1] == 429
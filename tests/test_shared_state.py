@@ -0,0 +1,83 @@
+import asyncio
+import runpy
+from pathlib import Path
+
+import pytest
+
+from shared_state import InProcessState
+
+GUNICORN_CONF = Path(__file__).resolve().parent.parent / "backend" / "gunicorn.conf.py"
+
+
+def test_lock_serialises_holders_and_drops_idle_locks():
+    state = InProcessState()
+    events = []
+
+    async def holder(name):
+        async with state.lock("slots", timeout=5):
+            events.append(f"{name}-in")
+            await asyncio.sleep(0.01)
+            events.append(f"{name}-out")
+
+    async def scenario():
+        await asyncio.gather(holder("a"), holder("b"))
+
+    asyncio.run(scenario())
+    assert events == ["a-in", "a-out", "b-in", "b-out"]
+    assert state._locks == {}
+
+
+def test_lock_lease_expires_after_timeout():
+    state = InProcessState()
+
+    async def scenario():
+        async def stuck():
+            async with state.lock("slots", timeout=0.05):
+                await asyncio.sleep(0.2)
+
+        task = asyncio.create_task(stuck())
+        await asyncio.sleep(0.01)
+        # The second caller gets in once the first holder's lease runs out
+        async def second():
+            async with state.lock("slots", timeout=1):
+                pass
+
+        await asyncio.wait_for(second(), timeout=0.15)
+        await task
+
+    asyncio.run(scenario())
+    assert state._locks == {}
+
+
+def test_values_expire_and_counters_increment():
+    state = InProcessState()
+
+    async def scenario():
+        await state.set("k", "v", ttl=0.01)
+        assert await state.get("k") == "v"
+        await asyncio.sleep(0.02)
+        assert await state.get("k") is None
+        assert await state.incr("n") == 1
+        assert await state.incr("n", 2) == 3
+
+    asyncio.run(scenario())
+
+
+def test_gunicorn_defaults_to_one_worker_without_redis(monkeypatch):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    assert runpy.run_path(str(GUNICORN_CONF))["workers"] == 1
+
+
+def test_gunicorn_refuses_multiple_workers_without_redis(monkeypatch):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    with pytest.raises(RuntimeError):
+        runpy.run_path(str(GUNICORN_CONF))
+
+
+def test_gunicorn_sizes_workers_to_cpus_with_redis(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379")
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    workers = runpy.run_path(str(GUNICORN_CONF))["workers"]
+    assert 1 <= workers <= 8
@@ -0,0 +1,174 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+DATE = (datetime.now(timezone.utc) + timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def make_user(db, name, balance=0.0):
+    user = server.User(email=f"{name}@example.com", name=name, wallet_balance=balance)
+    await db.users.insert_one(user.dict())
+    return user
+
+
+def booking_request(start_time="18:00", payment_method="wallet"):
+    return server.BookingCreate(
+        date=DATE,
+        start_time=start_time,
+        duration_minutes=60,
+        ps5_setup=1,
+        controllers=1,
+        payment_method=payment_method,
+    )
+
+
+async def balance(db, user):
+    return (await db.users.find_one({"id": user.id}))["wallet_balance"]
+
+
+def test_join_rejected_when_slot_is_free(db):
+    async def scenario():
+        waiter = await make_user(db, "waiter", 500)
+        with pytest.raises(HTTPException) as exc:
+            await server.join_waitlist(booking_request(), waiter)
+        assert exc.value.status_code == 400
+        assert await db.waitlist.count_documents({}) == 0
+
+    run(scenario())
+
+
+def test_join_rejected_for_past_date(db):
+    async def scenario():
+        waiter = await make_user(db, "waiter", 500)
+        request = booking_request()
+        request.date = "2000-01-01"
+        with pytest.raises(HTTPException) as exc:
+            await server.join_waitlist(request, waiter)
+        assert exc.value.status_code == 400
+
+    run(scenario())
+
+
+def test_join_is_deduplicated(db):
+    async def scenario():
+        owner = await make_user(db, "owner", 500)
+        waiter = await make_user(db, "waiter", 500)
+        await server.create_booking(booking_request(), owner)
+
+        first = await server.join_waitlist(booking_request(), waiter)
+        second = await server.join_waitlist(booking_request(), waiter)
+        assert first.id == second.id
+        assert await db.waitlist.count_documents({}) == 1
+
+    run(scenario())
+
+
+def test_cancel_allocates_to_first_waiter_and_refunds_once(db):
+    async def scenario():
+        owner = await make_user(db, "owner", 500)
+        first = await make_user(db, "first", 500)
+        second = await make_user(db, "second", 500)
+        booking = await server.create_booking(booking_request(), owner)
+        await server.join_waitlist(booking_request(), first)
+        await server.join_waitlist(booking_request(), second)
+
+        result = await server.cancel_booking(booking.id, owner)
+        assert result["refunded"] == booking.total_price
+        assert result["reallocated_to_waitlist"] == 1
+        assert await balance(db, owner) == 500
+        assert await balance(db, first) == 500 - booking.total_price
+        assert await balance(db, second) == 500
+
+        # A repeated cancel must not refund again
+        with pytest.raises(HTTPException) as exc:
+            await server.cancel_booking(booking.id, owner)
+        assert exc.value.status_code == 404
+        assert await balance(db, owner) == 500
+        assert await db.wallet_transactions.count_documents(
+            {"user_id": owner.id, "transaction_type": "refund"}
+        ) == 1
+
+    run(scenario())
+
+
+def test_unfunded_waiter_is_skipped_and_does_not_block_slot(db):
+    async def scenario():
+        owner = await make_user(db, "owner", 500)
+        broke = await make_user(db, "broke", 0)
+        funded = await make_user(db, "funded", 500)
+        booking = await server.create_booking(booking_request(), owner)
+        broke_entry = await server.join_waitlist(booking_request(), broke)
+        await server.join_waitlist(booking_request(), funded)
+
+        await server.cancel_booking(booking.id, owner)
+
+        entry = await db.waitlist.find_one({"id": broke_entry.id})
+        assert entry["status"] == "unfunded"
+        assert await balance(db, funded) == 500 - booking.total_price
+
+    run(scenario())
+
+
+def test_direct_booking_serves_queue_first(db):
+    async def scenario():
+        owner = await make_user(db, "owner", 500)
+        waiter = await make_user(db, "waiter", 500)
+        poller = await make_user(db, "poller", 500)
+        booking = await server.create_booking(booking_request(), owner)
+        await server.join_waitlist(booking_request(), waiter)
+
+        # Free the slot without running the matcher, as if a worker died mid-cancel
+        await db.bookings.update_one({"id": booking.id}, {"$set": {"status": "cancelled"}})
+
+        with pytest.raises(HTTPException):
+            await server.create_booking(booking_request(), poller)
+        assert await db.bookings.count_documents(
+            {"user_id": waiter.id, "status": "confirmed"}
+        ) == 1
+
+    run(scenario())
+
+
+def test_unfundable_waiter_does_not_block_direct_booking(db):
+    async def scenario():
+        owner = await make_user(db, "owner", 500)
+        broke = await make_user(db, "broke", 0)
+        poller = await make_user(db, "poller", 500)
+        booking = await server.create_booking(booking_request(), owner)
+        await server.join_waitlist(booking_request(), broke)
+        await db.bookings.update_one({"id": booking.id}, {"$set": {"status": "cancelled"}})
+
+        created = await server.create_booking(booking_request(), poller)
+        assert created.user_id == poller.id
+
+    run(scenario())
+
+
+def test_cancelled_allocation_does_not_loop_back_to_same_user(db):
+    async def scenario():
+        owner = await make_user(db, "owner", 500)
+        waiter = await make_user(db, "waiter", 500)
+        booking = await server.create_booking(booking_request(), owner)
+        await server.join_waitlist(booking_request(), waiter)
+        await server.cancel_booking(booking.id, owner)
+
+        allocated = await db.bookings.find_one({"user_id": waiter.id})
+        # A retried join while allocated returns the allocated entry instead of queueing again
+        retry = await server.join_waitlist(booking_request(), waiter)
+        assert retry.status == "allocated"
+
+        await server.cancel_booking(allocated["id"], waiter)
+        assert await balance(db, waiter) == 500
+        assert await db.bookings.count_documents(
+            {"user_id": waiter.id, "status": "confirmed"}
+        ) == 0
+
+    run(scenario())